@@ -142,7 +142,8 @@ const ArticleMetadataSchema = z.object({
 const TranscriptWhisperXJsonMetadataSchema = z.object({
   modelName: z.string(),
   wordCount: z.number().optional(),
-  segmentCount: z.number().optional()
+  segmentCount: z.number().optional(),
+  sourceHash: z.string().optional()
 });
 
 // FileItem schema with metadata based on type
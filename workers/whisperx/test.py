@@ -3,16 +3,17 @@
 Test script to verify WhisperX installation and functionality.
 This script should be run to check if WhisperX is properly installed
 and can transcribe audio files with word-level alignment.
-Supports testing models: tiny.en, medium.en, and large-v3.
+Supports testing models: tiny.en, medium.en, large-v3, distil-large-v3 and distil-medium.en.
 """
 
 import os
 import sys
-import json
 import argparse
 from pathlib import Path
 
-def test_whisperx(model_name="tiny.en"):
+from transcribe import COMPUTE_TYPES, MODEL_CHOICES, default_batch_size, dumps_json, load_audio, select_device
+
+def test_whisperx(model_name="tiny.en", device=None, compute_type=None, batch_size=None):
     """Test WhisperX functionality with specified model"""
     print(f"Testing WhisperX installation and functionality with model: {model_name}...")
     
@@ -54,21 +55,21 @@ def test_whisperx(model_name="tiny.en"):
     print(f"Using test audio file: {test_audio}")
     
     try:
-        # Set device to CPU for MacOS
-        device = "cpu"
-        compute_type = "int8"
+        device, compute_type = select_device(device, compute_type)
+        print(f"Using device {device} with compute type {compute_type}")
         
         # Load audio
         print("Loading audio...")
-        audio = whisperx.load_audio(test_audio)
+        audio = load_audio(test_audio)
         
         # Load model with specified name
         print(f"Loading WhisperX model ({model_name} for testing)...")
         model = whisperx.load_model(model_name, device, compute_type=compute_type)
         
         # Transcribe
-        print("Transcribing audio...")
-        result = model.transcribe(audio, batch_size=1)
+        batch_size = batch_size or default_batch_size(device)
+        print(f"Transcribing audio with batch size {batch_size}...")
+        result = model.transcribe(audio, batch_size=batch_size)
         
         # Get language
         detected_language = result["language"]
@@ -104,8 +105,8 @@ def test_whisperx(model_name="tiny.en"):
         os.makedirs(output_dir, exist_ok=True)
         
         output_file = os.path.join(output_dir, f'test_whisperx_{model_name.replace("-", "_")}_output.json')
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=4)
+        with open(output_file, 'wb') as f:
+            f.write(dumps_json(result))
         
         print(f"✅ WhisperX test with model {model_name} successful! Output saved to: {output_file}")
         print("\nSample of transcription result:")
@@ -124,9 +125,15 @@ def test_whisperx(model_name="tiny.en"):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Test WhisperX functionality")
-    parser.add_argument("--model", default="tiny.en", choices=["tiny.en", "medium.en", "large-v3"],
+    parser.add_argument("--model", default="tiny.en", choices=MODEL_CHOICES,
                         help="WhisperX model to test (default: tiny.en)")
+    parser.add_argument("--device", choices=["cpu", "cuda"],
+                        help="Inference device (default: autodetect)")
+    parser.add_argument("--compute-type", choices=COMPUTE_TYPES,
+                        help="CTranslate2 compute type (default: chosen for the device)")
+    parser.add_argument("--batch-size", type=int,
+                        help="VAD chunks transcribed per batch (default: 4 on CPU, 8-24 on GPU by memory)")
     args = parser.parse_args()
     
-    success = test_whisperx(args.model)
+    success = test_whisperx(args.model, args.device, args.compute_type, args.batch_size)
     sys.exit(0 if success else 1) 
\ No newline at end of file
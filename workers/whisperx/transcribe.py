@@ -2,50 +2,554 @@
 """
 WhisperX transcription worker for Yanghoo AI.
 This script processes extracted audio files and generates word-level transcriptions.
-Supports multiple model options: tiny.en, medium.en, and large-v3.
+Supports multiple model options: tiny.en, medium.en, large-v3 and the distilled
+distil-large-v3 / distil-medium.en.
+A single invocation can process a batch of manifests, loading the models only once.
 """
 
 import os
 import sys
 import json
+import glob
 import time
+import atexit
+import hashlib
+import importlib.metadata
+import itertools
+import platform
+import queue
+import signal
+import struct
 import argparse
+import threading
+from types import SimpleNamespace
 from pathlib import Path
 
-def update_progress(percent):
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SAMPLE_RATE = 16000
+# Streaming mode never holds more than this much unconfirmed audio
+STREAM_BUFFER_SECONDS = 30
+# Derived model artifacts (cached alignment models, ONNX exports) live here
+CACHE_DIR = Path(os.environ.get("YANGHOO_CACHE_DIR", Path.home() / ".cache" / "yanghoo"))
+MODEL_CHOICES = ["tiny.en", "medium.en", "large-v3", "distil-large-v3", "distil-medium.en"]
+COMPUTE_TYPES = ["int8", "int8_float16", "int8_float32", "float16", "float32"]
+
+# CPU flags that give CTranslate2 native INT8 dot products (x86 VNNI/AMX, ARM dotprod)
+INT8_CPU_FLAGS = {"avx512_vnni", "avx_vnni", "amx_int8", "asimddp"}
+
+# Batch pipeline stages report progress from different threads
+_stdout_lock = threading.Lock()
+
+# Jobs whose task is running, keyed by manifest path, so an unexpected exit can release them
+_active_jobs = {}
+# Serializes manifest writes and job releases between the pipeline stages and an interrupt
+_manifest_lock = threading.RLock()
+
+def write_line(line):
+    """Write one complete line to stdout for the orchestrator"""
+    with _stdout_lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+def now_iso():
+    """Current UTC time in the manifest timestamp format"""
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+def _numpy_default(obj):
+    """Convert numpy scalars and arrays that the stdlib encoder cannot handle"""
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def dumps_json(obj):
+    """Serialize to pretty-printed UTF-8 JSON, using orjson when it is installed"""
+    if orjson is not None:
+        # WhisperX results can carry numpy floats inside word entries
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, ensure_ascii=False, indent=2, default=_numpy_default).encode('utf-8')
+
+def save_manifest(manifest, manifest_path, updated_at=None):
+    """Stamp updatedAt and atomically replace the manifest on disk with the in-memory one"""
+    with _manifest_lock:
+        manifest['updatedAt'] = updated_at or now_iso()
+        # A reader (or a crash mid-write) never sees a truncated manifest
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(dumps_json(manifest))
+        os.replace(tmp_path, manifest_path)
+
+def update_progress(percent, file=None):
     """Print progress update in JSON format for the orchestrator to parse"""
-    print(json.dumps({"percent": percent}), flush=True)
+    if file is None:
+        write_line(json.dumps({"percent": percent}))
+    else:
+        write_line(json.dumps({"file": file, "percent": percent}))
 
-def main():
-    parser = argparse.ArgumentParser(description="WhisperX transcription worker")
-    parser.add_argument("--manifest", required=True, help="Path to manifest.json")
-    parser.add_argument("--hashId", required=True, help="Hash ID of the content bucket")
-    parser.add_argument("--model", default="medium.en", choices=["tiny.en", "medium.en", "large-v3"], 
-                        help="WhisperX model to use (default: medium.en)")
-    args = parser.parse_args()
+def cpu_has_fast_int8():
+    """Check /proc/cpuinfo for INT8 dot-product support; None when the flags cannot be read"""
+    try:
+        with open("/proc/cpuinfo", 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith(("flags", "Features")):
+                    return not INT8_CPU_FLAGS.isdisjoint(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return None
+
+def supported_compute_types(device):
+    """Compute types CTranslate2 reports for the device; None when it cannot be queried"""
+    try:
+        import ctranslate2
+        return set(ctranslate2.get_supported_compute_types(device))
+    except Exception:
+        return None
+
+def select_device(device=None, compute_type=None):
+    """Pick the inference device and a matching compute type, honouring explicit overrides"""
+    import torch
+    
+    if device is None:
+        # CTranslate2 has no MPS backend, so Apple GPUs fall back to CPU as well
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    
+    if compute_type is None:
+        if device == "cuda":
+            # INT8 tensor cores arrive with Turing (7.5); GPUs below 7.0 have no fast FP16 path
+            capability = torch.cuda.get_device_capability()
+            if capability >= (7, 5):
+                compute_type = "int8_float16"
+            elif capability >= (7, 0):
+                compute_type = "float16"
+            else:
+                compute_type = "float32"
+        elif platform.system() == "Darwin" and platform.machine() == "arm64":
+            # Apple Silicon runs FP16 natively; older CTranslate2 builds only offer INT8 there
+            supported = supported_compute_types(device)
+            compute_type = "float16" if supported and "float16" in supported else "int8"
+        else:
+            # Without VNNI-style instructions INT8 is emulated and slower than FP32
+            compute_type = "float32" if cpu_has_fast_int8() is False else "int8"
+    elif device == "cpu" and compute_type.startswith("int8") and cpu_has_fast_int8() is False:
+        print(f"Warning: {compute_type} requested but this CPU has no INT8 dot-product instructions; "
+              "quantized inference will be emulated and is likely slower than float32", file=sys.stderr)
+    
+    return device, compute_type
+
+def default_batch_size(device):
+    """Pick how many VAD chunks to feed through the encoder at once for the device"""
+    if device != "cuda":
+        return 4
+    
+    import torch
     
-    manifest_path = args.manifest
-    hash_id = args.hashId
-    model_name = args.model
+    total_memory_gb = torch.cuda.get_device_properties(0).total_memory / 1024 ** 3
+    if total_memory_gb < 8:
+        return 8
+    if total_memory_gb >= 16:
+        return 24
+    return 16
+
+def emit_partial(segments, file=None):
+    """Print newly confirmed streaming segments in JSON format for the orchestrator"""
+    if file is None:
+        write_line(json.dumps({"partial": segments}, ensure_ascii=False))
+    else:
+        write_line(json.dumps({"file": file, "partial": segments}, ensure_ascii=False))
+
+def to_mono_16k(data, sample_rate):
+    """Downmix decoded samples to mono and resample them to 16kHz"""
+    if data.ndim > 1:
+        data = data.mean(axis=1)
+    if sample_rate != SAMPLE_RATE:
+        import torch
+        import torchaudio.functional as F
+        data = F.resample(torch.from_numpy(data), sample_rate, SAMPLE_RATE).numpy()
+    return data
+
+def hash_file(path, chunk_size=1 << 20):
+    """Return the BLAKE2b digest of a file's contents, read in chunks"""
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def find_pcm16_samples(audio_path):
+    """Locate the samples of a 16kHz mono 16-bit PCM WAV as (offset, count); None for other files"""
+    with open(audio_path, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+            return None
+        
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+            if chunk_id == b'fmt ' and size >= 16:
+                fmt = struct.unpack('<HHIIHH', f.read(16))
+                f.seek(size - 16 + size % 2, os.SEEK_CUR)
+            elif chunk_id == b'data':
+                if fmt is None:
+                    return None
+                audio_format, channels, sample_rate, _, _, bits = fmt
+                if audio_format != 1 or channels != 1 or sample_rate != SAMPLE_RATE or bits != 16:
+                    return None
+                offset = f.tell()
+                # Streamed WAVs may leave the data size unset, so trust the file size
+                size = min(size, os.fstat(f.fileno()).st_size - offset)
+                return offset, size // 2
+            else:
+                f.seek(size + size % 2, os.SEEK_CUR)
+
+def load_audio(audio_path):
+    """Decode audio to 16kHz mono float32 in-process, falling back to whisperx's ffmpeg loader"""
+    # The extract-audio worker emits 16kHz mono PCM: map it and convert without a decode buffer
+    location = find_pcm16_samples(audio_path)
+    if location is not None:
+        import numpy as np
+        
+        offset, count = location
+        samples = np.memmap(audio_path, dtype='<i2', mode='r', offset=offset, shape=(count,))
+        audio = np.empty(count, dtype=np.float32)
+        np.divide(samples, 32768.0, out=audio, dtype=np.float32)
+        del samples
+        return audio
+    
+    try:
+        import soundfile as sf
+        data, sample_rate = sf.read(str(audio_path), dtype='float32', always_2d=False)
+    except (ImportError, RuntimeError):
+        # soundfile is missing or libsndfile cannot decode this container
+        import whisperx
+        return whisperx.load_audio(str(audio_path))
     
+    return to_mono_16k(data, sample_rate)
+
+def local_agreement(previous, current):
+    """LocalAgreement-2: the leading segments on which two consecutive hypotheses agree"""
+    agreed = []
+    for prev_segment, segment in zip(previous, current):
+        if prev_segment["text"].strip().lower() != segment["text"].strip().lower():
+            break
+        agreed.append(segment)
+    return agreed
+
+def drop_repeated_words(committed_words, text):
+    """Strip leading words that repeat the last 1-5 committed words (buffer overlap)"""
+    words = text.split()
+    for n in range(min(5, len(committed_words), len(words)), 0, -1):
+        if [w.lower() for w in committed_words[-n:]] == [w.lower() for w in words[:n]]:
+            return " " + " ".join(words[n:]) if len(words) > n else ""
+    return text
+
+def transcribe_streaming(model, audio_path, batch_size, chunk_seconds, file=None):
+    """Transcribe chunk by chunk over a rolling buffer, committing segments as they are confirmed
+    
+    Every chunk re-transcribes the unconfirmed buffer. Segments that two consecutive
+    hypotheses agree on are committed, emitted as partial results and trimmed from the
+    buffer, so output starts after the first chunks instead of after the whole file.
+    """
+    import numpy as np
+    import soundfile as sf
+    
+    info = sf.info(str(audio_path))
+    total_seconds = info.duration or 1
+    buffer = np.zeros(0, dtype=np.float32)
+    buffer_start = 0.0
+    committed = []
+    committed_words = []
+    previous = []
+    language = None
+    
+    def commit(segments):
+        nonlocal buffer, buffer_start
+        confirmed = []
+        for segment in segments:
+            text = drop_repeated_words(committed_words, segment["text"])
+            if text.strip():
+                confirmed.append({"start": segment["start"], "end": segment["end"], "text": text})
+                committed_words.extend(text.split())
+        if confirmed:
+            committed.extend(confirmed)
+            emit_partial(confirmed, file)
+        
+        # Drop the confirmed audio; the next hypothesis starts after it
+        cut = segments[-1]["end"]
+        buffer = buffer[max(0, int((cut - buffer_start) * SAMPLE_RATE)):]
+        buffer_start = max(buffer_start, cut)
+    
+    blocks = sf.blocks(str(audio_path), blocksize=int(info.samplerate * chunk_seconds),
+                       dtype='float32', always_2d=False)
+    for block in blocks:
+        buffer = np.concatenate([buffer, to_mono_16k(block, info.samplerate)])
+        result = model.transcribe(buffer, batch_size=batch_size, language=language)
+        language = result["language"]
+        current = [
+            dict(segment, start=segment["start"] + buffer_start, end=segment["end"] + buffer_start)
+            for segment in result["segments"]
+        ]
+        
+        window = STREAM_BUFFER_SECONDS * SAMPLE_RATE
+        agreed = local_agreement(previous, current)
+        if not agreed and len(buffer) > window and current:
+            # No agreement within the buffer window: confirm all but the newest segment,
+            # or a lone long segment outright
+            agreed = current[:-1] if len(current) > 1 else current
+        if agreed:
+            commit(agreed)
+        elif not current:
+            # Silence or music: keep only the last second, which may hold the start of a word
+            dropped = max(0, len(buffer) - SAMPLE_RATE)
+            buffer = buffer[dropped:]
+            buffer_start += dropped / SAMPLE_RATE
+        previous = current[len(agreed):]
+        
+        # A segment that ends well before the buffer does can still leave too much behind;
+        # drop the oldest audio so every pass re-transcribes at most the window
+        if len(buffer) > window:
+            dropped = len(buffer) - window
+            buffer = buffer[dropped:]
+            buffer_start += dropped / SAMPLE_RATE
+        
+        processed_seconds = buffer_start + len(buffer) / SAMPLE_RATE
+        update_progress(30 + int(30 * min(1.0, processed_seconds / total_seconds)), file)
+    
+    # End of audio: nothing will contradict the last hypothesis any more
+    if previous:
+        commit(previous)
+    
+    return {"segments": committed, "language": language}
+
+def configure_threads(threads):
+    """Size the OpenMP/MKL/OpenBLAS thread pools; only effective before torch is imported"""
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+
+def read_manifest_list(value):
+    """Expand --manifest-list into manifest paths: a newline-delimited file ('-' for stdin) or a glob"""
+    if value == "-":
+        return [line.strip() for line in sys.stdin if line.strip()]
+    if os.path.isfile(value):
+        with open(value, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f if line.strip()]
+    return sorted(glob.glob(value))
+
+def get_whisper_model(models, args):
+    """Load the WhisperX model on first use and keep it for the rest of the run"""
+    if models.get("whisper") is None or models.get("model_name") != args.model:
+        import torch
+        import whisperx
+        
+        torch.set_num_threads(args.threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Can only be set once, before any inter-op parallel work (e.g. on a reload)
+            pass
+        
+        device, compute_type = select_device(args.device, args.compute_type)
+        print(f"Using device {device} with compute type {compute_type}", file=sys.stderr)
+        print(f"Loading WhisperX model {args.model}...", file=sys.stderr)
+        models["device"] = device
+        models["model_name"] = args.model
+        # Release the previous model before loading a different one
+        models["whisper"] = None
+        models["whisper"] = whisperx.load_model(args.model, device, compute_type=compute_type,
+                                                threads=args.threads)
+    return models["whisper"]
+
+class OnnxAlignModel:
+    """Stand-in for the Wav2Vec2 alignment model that runs its exported graph in ONNX Runtime
+    
+    whisperx.align calls the model once per segment with a waveform already on the
+    device. The input is bound straight from that torch buffer and the emissions are
+    written to host memory, where whisperx moves them next anyway.
+    """
+    
+    def __init__(self, session, model_type):
+        self.session = session
+        self.model_type = model_type
+    
+    def __call__(self, waveform, lengths=None):
+        import numpy as np
+        import torch
+        
+        waveform = waveform.contiguous()
+        binding = self.session.io_binding()
+        if waveform.is_cuda:
+            binding.bind_input("waveform", device_type="cuda", device_id=waveform.device.index or 0,
+                               element_type=np.float32, shape=tuple(waveform.shape),
+                               buffer_ptr=waveform.data_ptr())
+        else:
+            binding.bind_cpu_input("waveform", waveform.numpy())
+        binding.bind_output("emissions", "cpu")
+        self.session.run_with_iobinding(binding)
+        emissions = torch.from_numpy(binding.copy_outputs_to_cpu()[0])
+        
+        if self.model_type == "torchaudio":
+            return emissions, lengths
+        return SimpleNamespace(logits=emissions)
+
+def load_onnx_align_model(align_model, align_metadata, language, device):
+    """Export the alignment model to ONNX once per language and open it in ONNX Runtime"""
+    import onnxruntime as ort
+    import torch
+    
+    onnx_path = CACHE_DIR / f"align_{language}.onnx"
+    if not onnx_path.exists():
+        model_type = align_metadata["type"]
+        
+        class Emissions(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.model = align_model
+            
+            def forward(self, waveform):
+                if model_type == "torchaudio":
+                    return self.model(waveform)[0]
+                return self.model(waveform).logits
+        
+        print(f"Exporting alignment model for {language} to {onnx_path}...", file=sys.stderr)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = onnx_path.with_suffix(".onnx.tmp")
+        torch.onnx.export(
+            Emissions().eval(),
+            torch.zeros(1, SAMPLE_RATE, device=device),
+            str(tmp_path),
+            opset_version=17,
+            input_names=["waveform"],
+            output_names=["emissions"],
+            dynamic_axes={"waveform": {1: "samples"}, "emissions": {1: "frames"}}
+        )
+        os.replace(tmp_path, onnx_path)
+    
+    providers = ["CPUExecutionProvider"]
+    if device == "cuda":
+        providers.insert(0, "CUDAExecutionProvider")
+    session = ort.InferenceSession(str(onnx_path), providers=providers)
+    # ORT falls back to the CPU with only a warning (e.g. the CPU-only package is installed),
+    # and a CPU session cannot read the CUDA waveforms whisperx passes in
+    if device == "cuda" and "CUDAExecutionProvider" not in session.get_providers():
+        raise RuntimeError("CUDAExecutionProvider is not available in ONNX Runtime")
+    return OnnxAlignModel(session, align_metadata["type"])
+
+def align_cache_path(language):
+    """Alignment cache file for a language, keyed on the library versions that define the model"""
+    versions = []
+    for package in ("torch", "torchaudio", "transformers", "whisperx"):
+        try:
+            versions.append(f"{package}={importlib.metadata.version(package)}")
+        except importlib.metadata.PackageNotFoundError:
+            versions.append(f"{package}=none")
+    key = hashlib.blake2b("\n".join(versions).encode('utf-8'), digest_size=6).hexdigest()
+    return CACHE_DIR / f"align_{language}_{key}.pt"
+
+def build_align_skeleton(cached):
+    """Rebuild the modules of a cached alignment model, without weights, the way whisperx does"""
+    if cached["metadata"]["type"] == "torchaudio":
+        import torchaudio
+        from torchaudio.pipelines._wav2vec2 import utils
+        
+        # Mirrors Wav2Vec2Bundle.get_model() without fetching the checkpoint
+        bundle = getattr(torchaudio.pipelines, cached["source"])
+        model = utils._get_model(bundle._model_type, bundle._params)
+        if bundle._normalize_waveform:
+            model = utils._extend_model(model, normalize_waveform=True)
+        return model
+    
+    from transformers import Wav2Vec2Config, Wav2Vec2ForCTC
+    return Wav2Vec2ForCTC(Wav2Vec2Config.from_dict(json.loads(cached["source"])))
+
+def load_cached_align_model(language, device):
+    """Load the alignment model for a language, memory-mapping a local copy after the first run"""
+    import torch
+    
+    cache_path = align_cache_path(language)
+    if cache_path.exists():
+        try:
+            # weights_only accepts tensors and plain containers only, so loading runs no code;
+            # mmap only pages in the weights that are touched instead of copying the file into RAM
+            cached = torch.load(cache_path, mmap=True, map_location="cpu", weights_only=True)
+            with torch.device("meta"):
+                align_model = build_align_skeleton(cached)
+            align_model.load_state_dict(cached["state_dict"], assign=True)
+            if any(t.is_meta for t in itertools.chain(align_model.parameters(), align_model.buffers())):
+                raise RuntimeError("cached weights do not cover the model")
+            return align_model.eval().to(device), cached["metadata"]
+        except Exception as e:
+            print(f"Ignoring unreadable alignment cache {cache_path}: {str(e)}", file=sys.stderr)
+    
+    import whisperx
+    from whisperx.alignment import DEFAULT_ALIGN_MODELS_TORCH
+    
+    align_model, align_metadata = whisperx.load_align_model(
+        language_code=language,
+        device=device
+    )
+    try:
+        # Enough to rebuild the modules: a torchaudio bundle name or the HF config
+        if align_metadata["type"] == "torchaudio":
+            source = DEFAULT_ALIGN_MODELS_TORCH[language]
+        else:
+            source = align_model.config.to_json_string()
+        state_dict = {name: tensor.cpu() for name, tensor in align_model.state_dict().items()}
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = cache_path.with_suffix(".pt.tmp")
+        torch.save({"source": source, "metadata": align_metadata, "state_dict": state_dict}, tmp_path)
+        os.replace(tmp_path, cache_path)
+        # Drop copies written by other library versions
+        for stale_path in CACHE_DIR.glob(f"align_{language}*.pt"):
+            if stale_path != cache_path:
+                stale_path.unlink()
+    except Exception as e:
+        print(f"Could not cache alignment model: {str(e)}", file=sys.stderr)
+    return align_model, align_metadata
+
+def get_align_model(models, language, args):
+    """Load the alignment model for a language on first use, cached by language code"""
+    align_models = models.setdefault("align", {})
+    if language not in align_models:
+        print(f"Loading alignment model for {language}...", file=sys.stderr)
+        align_model, align_metadata = load_cached_align_model(language, models["device"])
+        if args.align_backend == "onnx":
+            try:
+                align_model = load_onnx_align_model(align_model, align_metadata, language, models["device"])
+            except Exception as e:
+                print(f"ONNX alignment unavailable, using PyTorch: {str(e)}", file=sys.stderr)
+        align_models[language] = (align_model, align_metadata)
+    return align_models[language]
+
+def prepare_job(manifest_path, model_name, file=None):
+    """Validate the manifest, mark the transcription task as running and return the job state"""
     # Load manifest
     try:
         with open(manifest_path, 'r', encoding='utf-8') as f:
             manifest = json.load(f)
     except Exception as e:
         print(f"Error loading manifest: {str(e)}", file=sys.stderr)
-        return 1
+        return None
     
-    # Find extracted audio file in the manifest
-    audio_file = None
+    # Index the manifest once; the entries are shared, so edits land in the manifest itself
+    files_by_type = {}
     for item in manifest['fileManifest']:
-        if item['type'] == 'extracted_audio' and item['state'] == 'ready':
-            audio_file = item
-            break
+        files_by_type.setdefault(item['type'], []).append(item)
+    tasks_by_id = {}
+    for task in manifest['tasks']:
+        tasks_by_id.setdefault(task['id'], task)
+    
+    # Find extracted audio file in the manifest
+    audio_file = next((item for item in files_by_type.get('extracted_audio', [])
+                       if item['state'] == 'ready'), None)
     
     if not audio_file:
         print("No ready extracted_audio found in manifest", file=sys.stderr)
-        return 1
+        return None
     
     # Determine full path to audio file
     storage_root = Path(manifest_path).parent
@@ -53,7 +557,7 @@ def main():
     
     if not audio_path.exists():
         print(f"Audio file not found: {audio_path}", file=sys.stderr)
-        return 1
+        return None
     
     # Create output directory
     output_dir = storage_root / "transcripts" / "whisperx"
@@ -62,28 +566,53 @@ def main():
     # Define output path
     output_path = output_dir / "transcript.json"
     
-    # Update task status to running
-    whisperx_task = None
-    for task in manifest['tasks']:
-        if task['id'] == 'transcribe_whisperx' and task['state'] == 'queued':
-            task['state'] = 'running'
-            task['startedAt'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
-            whisperx_task = task
-            break
+    job = {
+        "manifest": manifest,
+        "manifest_path": manifest_path,
+        "audio_path": audio_path,
+        "output_path": output_path,
+        "model_name": model_name,
+        "file": file,
+        "source_hash": hash_file(audio_path),
+        "cached": False
+    }
+    
+    whisperx_task = tasks_by_id.get('transcribe_whisperx')
+    transcript_item = (files_by_type.get('transcript_whisperx_json') or [None])[0]
+    
+    # Skip the work when the same audio was already transcribed with the same model
+    if transcript_item:
+        metadata = transcript_item.get('metadata') or {}
+        if (transcript_item['state'] == 'ready' and output_path.exists()
+                and metadata.get('sourceHash') == job["source_hash"]
+                and metadata.get('modelName') == model_name):
+            now = now_iso()
+            if whisperx_task:
+                whisperx_task['state'] = 'done'
+                whisperx_task['percent'] = 100
+                whisperx_task['updatedAt'] = now
+            save_manifest(manifest, manifest_path, now)
+            update_progress(100, file)
+            print(f"Transcript for {audio_path} with model {model_name} is up to date, skipping", file=sys.stderr)
+            job["cached"] = True
+            return job
     
-    if not whisperx_task:
+    # Update task status to running
+    if not whisperx_task or whisperx_task['state'] != 'queued':
         print("No queued transcribe_whisperx task found in manifest", file=sys.stderr)
-        return 1
+        return None
+    whisperx_task['state'] = 'running'
+    whisperx_task['startedAt'] = now_iso()
     
     # Add whisperx transcript item to file manifest if not exists
-    transcript_item = None
-    for item in manifest['fileManifest']:
-        if item['type'] == 'transcript_whisperx_json':
-            transcript_item = item
-            item['state'] = 'processing'
-            break
-    
-    if not transcript_item:
+    if transcript_item:
+        transcript_item['state'] = 'processing'
+        # Update metadata with model information
+        if transcript_item['metadata'] is None:
+            transcript_item['metadata'] = {}
+        transcript_item['metadata']['modelName'] = model_name
+        transcript_item['generatedBy'] = f"whisperx@1.0.0-{model_name}"
+    else:
         # Create new transcript item
         transcript_path = os.path.join("transcripts", "whisperx", "transcript.json")
         transcript_item = {
@@ -98,154 +627,378 @@ def main():
             }
         }
         manifest['fileManifest'].append(transcript_item)
-    else:
-        # Update metadata with model information
-        if transcript_item['metadata'] is None:
-            transcript_item['metadata'] = {}
-        transcript_item['metadata']['modelName'] = model_name
-        transcript_item['generatedBy'] = f"whisperx@1.0.0-{model_name}"
     
     # Save manifest with updated task status
-    with open(manifest_path, 'w', encoding='utf-8') as f:
-        manifest['updatedAt'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
-        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    save_manifest(manifest, manifest_path)
     
-    # Initialize WhisperX and transcribe
-    update_progress(5)
+    update_progress(5, file)
     
-    try:
-        import whisperx
-        import torch
-        
-        # Set device to CPU for MacOS (can be made configurable for other platforms)
-        device = "cpu"
-        compute_type = "int8"
-        
-        # Load audio
-        update_progress(10)
-        print(f"Loading audio and using model: {model_name}...", file=sys.stderr)
-        audio = whisperx.load_audio(str(audio_path))
-        
-        # Load model
-        update_progress(20)
-        print(f"Loading WhisperX model {model_name}...", file=sys.stderr)
-        model = whisperx.load_model(model_name, device, compute_type=compute_type)
-        
-        # Transcribe
-        update_progress(30)
+    # The manifest stays in memory for the rest of the job instead of being re-read
+    job["task"] = whisperx_task
+    job["transcript_item"] = transcript_item
+    _active_jobs[manifest_path] = job
+    return job
+
+def transcribe_job(job, models, args):
+    """Load the job's audio and run WhisperX transcription on it"""
+    # Load audio
+    update_progress(10, job["file"])
+    print(f"Loading audio and using model: {job['model_name']}...", file=sys.stderr)
+    if not args.streaming:
+        job["audio"] = load_audio(job["audio_path"])
+    
+    # Load model
+    update_progress(20, job["file"])
+    model = get_whisper_model(models, args)
+    
+    # Transcribe
+    update_progress(30, job["file"])
+    batch_size = args.batch_size or default_batch_size(models["device"])
+    if args.streaming:
+        print(f"Transcribing audio in {args.min_chunk_size}s chunks...", file=sys.stderr)
+        job["result"] = transcribe_streaming(model, job["audio_path"], batch_size,
+                                             args.min_chunk_size, job["file"])
+        # Alignment still needs the whole waveform
+        job["audio"] = load_audio(job["audio_path"])
+    else:
         print("Transcribing audio...", file=sys.stderr)
-        result = model.transcribe(audio, batch_size=1)
-        
-        # Get language
-        detected_language = result["language"]
-        print(f"Detected language: {detected_language}", file=sys.stderr)
-        
-        # Load alignment model
-        update_progress(60)
-        print("Loading alignment model...", file=sys.stderr)
-        align_model, align_metadata = whisperx.load_align_model(
-            language_code=detected_language,
-            device=device
-        )
-        
-        # Align
-        update_progress(70)
-        print("Performing word-level alignment...", file=sys.stderr)
-        result = whisperx.align(
-            result["segments"],
-            align_model,
-            align_metadata,
-            audio,
-            device,
-            return_char_alignments=False
-        )
-        
-        # Add model information to result
-        result["model_info"] = {
-            "name": model_name,
-            "transcribed_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
-        }
-        
-        # Save result to output file
-        update_progress(90)
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(result, f, ensure_ascii=False, indent=4)
-        
-        # Print sample of transcription for debugging
-        print("\nSample of transcription result:", file=sys.stderr)
-        for segment in result["segments"][:2]:  # Show first 2 segments
-            print(f"Segment {segment['id']}: {segment['text']}", file=sys.stderr)
-            if 'words' in segment:
-                print(f"  Word count: {len(segment['words'])}", file=sys.stderr)
-                for word in segment['words'][:3]:  # Show first 3 words
-                    print(f"  - '{word['word']}': {word['start']:.2f}s to {word['end']:.2f}s", file=sys.stderr)
-        
-        update_progress(95)
-        
-        # Update manifest with completed status
-        with open(manifest_path, 'r', encoding='utf-8') as f:
-            manifest = json.load(f)
+        job["result"] = model.transcribe(job["audio"], batch_size=batch_size)
+    
+    # Get language
+    print(f"Detected language: {job['result']['language']}", file=sys.stderr)
+
+def align_job(job, models, args):
+    """Run word-level alignment on the job's transcription"""
+    import whisperx
+    
+    # Load alignment model
+    update_progress(60, job["file"])
+    align_model, align_metadata = get_align_model(models, job["result"]["language"], args)
+    
+    # Align
+    update_progress(70, job["file"])
+    print("Performing word-level alignment...", file=sys.stderr)
+    job["result"] = whisperx.align(
+        job["result"]["segments"],
+        align_model,
+        align_metadata,
+        job.pop("audio"),
+        models["device"],
+        return_char_alignments=False
+    )
+    
+    # Count words while the segments are hot instead of walking them again at the end
+    word_count = 0
+    for segment in job["result"]["segments"]:
+        word_count += len(segment.get('words', ()))
+    job["word_count"] = word_count
+    job["segment_count"] = len(job["result"]["segments"])
+
+def finish_job(job):
+    """Write the transcript and mark the task and transcript item as done in the manifest"""
+    manifest = job["manifest"]
+    model_name = job["model_name"]
+    result = job["result"]
+    now = now_iso()
+    
+    # Add model information to result
+    result["model_info"] = {
+        "name": model_name,
+        "transcribed_at": now
+    }
+    
+    # Save result to output file
+    update_progress(90, job["file"])
+    with open(job["output_path"], 'wb') as f:
+        f.write(dumps_json(result))
+    
+    # Print sample of transcription for debugging
+    print("\nSample of transcription result:", file=sys.stderr)
+    for segment in result["segments"][:2]:  # Show first 2 segments
+        print(f"Segment {segment['id']}: {segment['text']}", file=sys.stderr)
+        if 'words' in segment:
+            print(f"  Word count: {len(segment['words'])}", file=sys.stderr)
+            for word in segment['words'][:3]:  # Show first 3 words
+                print(f"  - '{word['word']}': {word['start']:.2f}s to {word['end']:.2f}s", file=sys.stderr)
+    
+    update_progress(95, job["file"])
+    
+    with _manifest_lock:
+        # An interrupt may already have released the job as failed
+        if job["manifest_path"] not in _active_jobs:
+            return
         
         # Update task state
-        for task in manifest['tasks']:
-            if task['id'] == 'transcribe_whisperx':
-                task['state'] = 'done'
-                task['percent'] = 100
-                task['updatedAt'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
-                # Add model info to task context
-                if task['context'] is None:
-                    task['context'] = {}
-                task['context']['modelName'] = model_name
-                break
+        task = job["task"]
+        task['state'] = 'done'
+        task['percent'] = 100
+        task['updatedAt'] = now
+        # Add model info to task context
+        if task['context'] is None:
+            task['context'] = {}
+        task['context']['modelName'] = model_name
         
         # Update file state
-        for item in manifest['fileManifest']:
-            if item['type'] == 'transcript_whisperx_json':
-                item['state'] = 'ready'
-                # Ensure metadata is updated
-                if item['metadata'] is None:
-                    item['metadata'] = {}
-                item['metadata']['modelName'] = model_name
-                item['metadata']['wordCount'] = sum(len(segment.get('words', [])) for segment in result['segments'])
-                item['metadata']['segmentCount'] = len(result['segments'])
-                break
+        item = job["transcript_item"]
+        item['state'] = 'ready'
+        # Ensure metadata is updated
+        if item['metadata'] is None:
+            item['metadata'] = {}
+        item['metadata']['modelName'] = model_name
+        item['metadata']['wordCount'] = job["word_count"]
+        item['metadata']['segmentCount'] = job["segment_count"]
+        item['metadata']['sourceHash'] = job["source_hash"]
         
         # Save updated manifest
-        with open(manifest_path, 'w', encoding='utf-8') as f:
-            manifest['updatedAt'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
-            json.dump(manifest, f, ensure_ascii=False, indent=2)
-        
-        update_progress(100)
-        print(f"WhisperX transcription with model {model_name} completed successfully", file=sys.stderr)
-        return 0
-        
-    except Exception as e:
-        print(f"Error in WhisperX transcription: {str(e)}", file=sys.stderr)
-        
-        # Update manifest with error status
-        with open(manifest_path, 'r', encoding='utf-8') as f:
-            manifest = json.load(f)
+        save_manifest(manifest, job["manifest_path"], now)
+        _active_jobs.pop(job["manifest_path"], None)
+    
+    update_progress(100, job["file"])
+    print(f"WhisperX transcription with model {model_name} completed successfully", file=sys.stderr)
+
+def fail_job(job, error):
+    """Mark the task and transcript item as failed in the manifest"""
+    manifest = job["manifest"]
+    now = now_iso()
+    # KeyboardInterrupt and SystemExit carry no useful message of their own
+    if isinstance(error, BaseException) and not isinstance(error, Exception):
+        message = f"Interrupted ({type(error).__name__})"
+    else:
+        message = str(error)
+    print(f"Error in WhisperX transcription: {message}", file=sys.stderr)
+    
+    with _manifest_lock:
+        # Released already, either as done or by an interrupt
+        if job["manifest_path"] not in _active_jobs:
+            return
         
         # Update task state
-        for task in manifest['tasks']:
-            if task['id'] == 'transcribe_whisperx':
-                task['state'] = 'error'
-                task['error'] = str(e)
-                task['updatedAt'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
-                break
+        task = job["task"]
+        task['state'] = 'error'
+        task['error'] = message
+        task['updatedAt'] = now
         
         # Update file state
-        for item in manifest['fileManifest']:
-            if item['type'] == 'transcript_whisperx_json':
-                item['state'] = 'error'
-                break
+        job["transcript_item"]['state'] = 'error'
         
         # Save updated manifest
-        with open(manifest_path, 'w', encoding='utf-8') as f:
-            manifest['updatedAt'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
-            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        save_manifest(manifest, job["manifest_path"], now)
+        _active_jobs.pop(job["manifest_path"], None)
+
+def fail_active_jobs():
+    """Mark every job still in flight as failed; registered with atexit"""
+    for job in list(_active_jobs.values()):
+        try:
+            fail_job(job, "Worker exited before the transcription finished")
+        except Exception as e:
+            print(f"Error releasing {job['manifest_path']}: {str(e)}", file=sys.stderr)
+
+def process_manifest(manifest_path, args, models, file=None):
+    """Transcribe and align the audio referenced by one manifest, reusing loaded models"""
+    job = prepare_job(manifest_path, args.model, file)
+    if job is None:
+        return 1
+    if job["cached"]:
+        return 0
+    
+    try:
+        transcribe_job(job, models, args)
+        align_job(job, models, args)
+        finish_job(job)
+        return 0
+    except BaseException as e:
+        fail_job(job, e)
+        if not isinstance(e, Exception):
+            raise
+        return 1
+
+def process_batch(manifest_paths, args, models):
+    """Pipeline a batch: the next file is transcribed while the previous one is aligned"""
+    transcribed = queue.Queue(maxsize=2)
+    failed = []
+    errors = []
+    stop = threading.Event()
+    
+    def transcribe_stage():
+        try:
+            for manifest_path in manifest_paths:
+                if stop.is_set():
+                    break
+                print(f"Processing {manifest_path}...", file=sys.stderr)
+                try:
+                    job = prepare_job(manifest_path, args.model, file=manifest_path)
+                except Exception as e:
+                    # A malformed manifest fails on its own; the rest of the batch still runs
+                    print(f"Error processing {manifest_path}: {str(e)}", file=sys.stderr)
+                    job = None
+                if job is None:
+                    failed.append(manifest_path)
+                    continue
+                if job["cached"]:
+                    continue
+                if stop.is_set():
+                    # Interrupted while the job was being prepared
+                    fail_job(job, "Batch interrupted before transcription")
+                    break
+                try:
+                    transcribe_job(job, models, args)
+                except BaseException as e:
+                    fail_job(job, e)
+                    failed.append(manifest_path)
+                    if not isinstance(e, Exception):
+                        stop.set()
+                    continue
+                transcribed.put(job)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            transcribed.put(None)
+    
+    def align_stage():
+        stream = None
+        while True:
+            job = transcribed.get()
+            if job is None:
+                return
+            if stop.is_set():
+                fail_job(job, "Batch interrupted before alignment")
+                failed.append(job["manifest_path"])
+                continue
+            try:
+                if models["device"] == "cuda":
+                    # Keep alignment kernels off the stream CTranslate2 uses for transcription
+                    import torch
+                    stream = stream or torch.cuda.Stream()
+                    with torch.cuda.stream(stream):
+                        align_job(job, models, args)
+                else:
+                    align_job(job, models, args)
+                finish_job(job)
+            except BaseException as e:
+                fail_job(job, e)
+                failed.append(job["manifest_path"])
+                if not isinstance(e, Exception):
+                    stop.set()
+    
+    # Daemon threads, so an interrupt does not have to wait for a long transcription to return
+    stages = [threading.Thread(target=transcribe_stage, daemon=True),
+              threading.Thread(target=align_stage, daemon=True)]
+    for stage in stages:
+        stage.start()
+    try:
+        for stage in stages:
+            stage.join()
+    except BaseException:
+        stop.set()
+        fail_active_jobs()
+        raise
+    
+    if errors:
+        raise errors[0]
+    return 1 if failed else 0
+
+def run_daemon(args, models):
+    """Serve jobs from stdin with the models kept loaded between them
+    
+    Each input line is "<manifest path>\\t<hash id>[\\t<model>]". Once the model is
+    warm "READY" is written, and after each job "OK\\t<manifest path>" or
+    "ERROR\\t<manifest path>". SIGHUP drops the cached models before the next job.
+    """
+    reload_requested = threading.Event()
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: reload_requested.set())
+    
+    get_whisper_model(models, args)
+    write_line("READY")
+    
+    for line in sys.stdin:
+        fields = line.rstrip("\n").split("\t")
+        manifest_path = fields[0].strip()
+        if not manifest_path:
+            continue
+        
+        if reload_requested.is_set():
+            print("Reloading models...", file=sys.stderr)
+            models.clear()
+            reload_requested.clear()
         
+        job_args = args
+        if len(fields) > 2 and fields[2].strip():
+            model_name = fields[2].strip()
+            if model_name not in MODEL_CHOICES:
+                print(f"Unsupported model: {model_name}", file=sys.stderr)
+                write_line(f"ERROR\t{manifest_path}")
+                continue
+            job_args = argparse.Namespace(**{**vars(args), "model": model_name})
+        
+        try:
+            exit_code = process_manifest(manifest_path, job_args, models, file=manifest_path)
+        except Exception as e:
+            # A malformed manifest fails its own job, not the whole worker
+            print(f"Error processing {manifest_path}: {str(e)}", file=sys.stderr)
+            exit_code = 1
+        write_line(f"{'OK' if exit_code == 0 else 'ERROR'}\t{manifest_path}")
+    
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="WhisperX transcription worker")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", help="Path to manifest.json")
+    source.add_argument("--manifest-list",
+                        help="File with one manifest path per line ('-' for stdin), or a glob pattern")
+    source.add_argument("--daemon", action="store_true",
+                        help="Keep the models loaded and read jobs from stdin, one per line")
+    parser.add_argument("--hashId", help="Hash ID of the content bucket")
+    parser.add_argument("--model", default="medium.en", choices=MODEL_CHOICES,
+                        help="WhisperX model to use (default: medium.en)")
+    parser.add_argument("--device", choices=["cpu", "cuda"],
+                        help="Inference device (default: autodetect)")
+    parser.add_argument("--compute-type", choices=COMPUTE_TYPES,
+                        help="CTranslate2 compute type (default: chosen for the device)")
+    parser.add_argument("--batch-size", type=int,
+                        help="VAD chunks transcribed per batch (default: 4 on CPU, 8-24 on GPU by memory)")
+    parser.add_argument("--align-backend", default="torch", choices=["torch", "onnx"],
+                        help="Runtime for the word alignment model (default: torch)")
+    parser.add_argument("--threads", type=int,
+                        help="CPU threads for inference (default: $OMP_NUM_THREADS or min(4, CPU count))")
+    parser.add_argument("--offline", action="store_true",
+                        help="Load models from the local cache only, without contacting the Hugging Face Hub "
+                             "(populate it with warmup.py first; also enabled by HF_HUB_OFFLINE=1)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Transcribe in chunks and emit confirmed segments as they are ready")
+    parser.add_argument("--min-chunk-size", type=float, default=5.0,
+                        help="Seconds of audio read per streaming iteration (default: 5)")
+    args = parser.parse_args()
+    
+    # Thread pools are sized when torch is first imported, so configure them up front
+    if args.threads is None:
+        args.threads = int(os.environ.get("OMP_NUM_THREADS") or min(4, os.cpu_count() or 1))
+    configure_threads(args.threads)
+    # huggingface_hub reads this when it is imported
+    if args.offline:
+        os.environ["HF_HUB_OFFLINE"] = "1"
+    
+    # A task left "running" would keep the orchestrator waiting, so release it on any exit;
+    # SIGTERM is turned into SystemExit so the handlers get to run
+    atexit.register(fail_active_jobs)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+    
+    # Models are shared by every manifest processed in this invocation
+    models = {}
+    
+    if args.manifest:
+        return process_manifest(args.manifest, args, models)
+    
+    if args.daemon:
+        return run_daemon(args, models)
+    
+    manifest_paths = read_manifest_list(args.manifest_list)
+    if not manifest_paths:
+        print(f"No manifests found for: {args.manifest_list}", file=sys.stderr)
         return 1
+    
+    return process_batch(manifest_paths, args, models)
 
 if __name__ == "__main__":
     exit_code = main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Pre-download the WhisperX models so the worker can start without network access.
+Run this once as a build step (e.g. in the container image). It fills the Hugging
+Face cache with every model in MODEL_CHOICES and stores the alignment models for
+the requested languages in the worker's alignment cache. Afterwards, run the worker
+with --offline (or HF_HUB_OFFLINE=1) to skip the Hub lookup on every cold start.
+"""
+
+import sys
+import argparse
+
+from transcribe import CACHE_DIR, MODEL_CHOICES, load_cached_align_model
+
+def warmup(model_names, languages):
+    """Load each model once on the CPU so its files end up in the local caches"""
+    import whisperx
+    
+    failed = []
+    for model_name in model_names:
+        print(f"Caching WhisperX model {model_name}...", file=sys.stderr)
+        try:
+            # Loading on the CPU with int8 is enough to fetch the weights and needs no GPU
+            model = whisperx.load_model(model_name, "cpu", compute_type="int8")
+            del model
+        except Exception as e:
+            print(f"Failed to cache {model_name}: {str(e)}", file=sys.stderr)
+            failed.append(model_name)
+    
+    for language in languages:
+        print(f"Caching alignment model for {language} in {CACHE_DIR}...", file=sys.stderr)
+        try:
+            load_cached_align_model(language, "cpu")
+        except Exception as e:
+            print(f"Failed to cache alignment model for {language}: {str(e)}", file=sys.stderr)
+            failed.append(f"align_{language}")
+    
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-download WhisperX models")
+    parser.add_argument("--model", action="append", choices=MODEL_CHOICES,
+                        help="Model to cache; repeat for several (default: all supported models)")
+    parser.add_argument("--language", action="append",
+                        help="Language whose alignment model to cache; repeat for several (default: en)")
+    args = parser.parse_args()
+    
+    failed = warmup(args.model or MODEL_CHOICES, args.language or ["en"])
+    if failed:
+        print(f"Could not cache: {', '.join(failed)}", file=sys.stderr)
+    sys.exit(1 if failed else 0)
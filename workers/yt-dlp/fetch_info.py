@@ -8,13 +8,25 @@ import sys
 import json
 import argparse
 import subprocess
-import shutil
-import time
 import re
+import time
+import shutil
+import hashlib
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, Any, List, Optional, Union
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple, Union
 import requests
 import logging
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger("subtitle_extractor")
 
 # Constants for quality selection
 QUALITY_BEST = "best"
@@ -22,6 +34,14 @@ QUALITY_1080P = "1080p"
 QUALITY_720P = "720p"
 QUALITY_360P = "360p"
 
+# yt-dlp format selector for each quality
+QUALITY_FORMATS = {
+    QUALITY_BEST: "bestvideo+bestaudio/best",
+    QUALITY_1080P: "bestvideo[height<=1080]+bestaudio/best[height<=1080]",
+    QUALITY_720P: "bestvideo[height<=720]+bestaudio/best[height<=720]",
+    QUALITY_360P: "bestvideo[height<=360]+bestaudio/best[height<=360]"
+}
+
 # Constants for file types
 FILE_TYPE_ORIGINAL_MEDIA = "original_media"
 FILE_TYPE_ORIGINAL_THUMBNAIL = "original_thumbnail"
@@ -29,6 +49,16 @@ FILE_TYPE_INFO_JSON = "info_json"
 FILE_TYPE_TRANSCRIPT_EN_VTT = "transcript_en_vtt"
 FILE_TYPE_TRANSCRIPT_ZH_VTT = "transcript_zh_vtt"
 
+# Subtitle language variants in priority order, per transcript language
+_EN_LANGS = ("en", "en-US", "en-orig", "en-GB")
+_ZH_LANGS = ("zh", "zh-Hans", "zh-CN", "zh-TW", "zh-HK")
+LANG_GROUPS = {
+    "en": _EN_LANGS,
+    "zh": _ZH_LANGS
+}
+# info.json subtitle tables, manual subtitles before automatic captions
+SUBTITLE_SOURCES = ("subtitles", "automatic_captions")
+
 # Manifest file states
 STATE_QUEUED = "queued"
 STATE_PROCESSING = "processing"
@@ -41,243 +71,293 @@ TASK_RUNNING = "running"
 TASK_DONE = "done"
 TASK_ERROR = "error"
 
+# Marks yt-dlp download progress lines; set through --progress-template in fetch_video_info
+PROGRESS_PREFIX = "[progress]"
+_PROGRESS_RE = re.compile(re.escape(PROGRESS_PREFIX) + r"\s*(\d+(?:\.\d+)?)%")
+
+# Subtitle and thumbnail downloads share one pooled session, so repeat requests to the
+# same CDN host reuse the TLS connection; transient failures are retried with backoff
+HTTP_TIMEOUT = 30
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8,
+                                       max_retries=Retry(total=3, backoff_factor=0.3)))
+
+# yt-dlp info for recently fetched URLs, reused instead of re-running the extractor
+CACHE_DIR = Path(os.environ.get("YANGHOO_CACHE_DIR", Path.home() / ".cache" / "yanghoo"))
+INFO_CACHE_DIR = CACHE_DIR / "info"
+# Media URLs inside the info expire after a few hours, so keep entries well below that
+DEFAULT_CACHE_TTL = 3600
+
+# Highest percent written, so repeated or lower reports are dropped
+_last_percent = None
+
+def _now_iso() -> str:
+    """Current UTC time as an ISO 8601 string with milliseconds, like JavaScript's toISOString()"""
+    now = datetime.now(timezone.utc)
+    return now.strftime("%Y-%m-%dT%H:%M:%S.") + f"{now.microsecond // 1000:03d}Z"
+
+def _loads(data: bytes) -> Any:
+    """Parse JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # yt-dlp writes info.json with Python's json, which emits NaN/Infinity for
+            # non-finite floats; orjson rejects those, the stdlib parser accepts them
+            pass
+    return json.loads(data)
+
+def _dumps(obj: Any) -> bytes:
+    """Serialize to pretty-printed UTF-8 JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+
+def _load_manifest(manifest_path: str) -> Optional[Dict[str, Any]]:
+    """Read manifest.json, or return None if it does not exist yet"""
+    try:
+        with open(manifest_path, 'rb') as f:
+            return _loads(f.read())
+    except FileNotFoundError:
+        return None
+
+def _save_manifest(manifest: Dict[str, Any], manifest_path: str) -> None:
+    """Atomically replace manifest.json so readers never see a partial write"""
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_dumps(manifest))
+        # Make the data durable before the rename, or a power loss could leave an empty manifest
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, manifest_path)
+
 def report_progress(percent: int) -> None:
     """Print progress as JSON to stdout for parent process to parse"""
+    global _last_percent
+    # Never step back, e.g. when a download is retried from the URL after a cache miss;
+    # whole rising percents bound the output to about a hundred lines, so each is flushed
+    # and the parent never shows a stale value during post-processing
+    if _last_percent is not None and percent <= _last_percent:
+        return
+    _last_percent = percent
     sys.stdout.write(json.dumps({"percent": percent}) + "\n")
     sys.stdout.flush()
 
+def run_yt_dlp_with_progress(args: List[str], start: int, end: int) -> None:
+    """Run yt-dlp and report its download progress scaled into [start, end]"""
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, text=True, encoding='utf-8',
+                               errors='replace', bufsize=1)
+    last_percent = start
+    try:
+        for line in process.stdout:
+            match = _PROGRESS_RE.match(line)
+            if match is None:
+                # stdout carries our JSON progress lines, so pass yt-dlp's own output to stderr
+                sys.stderr.write(line)
+                continue
+            # Separate video and audio downloads each count from 0%; never report a step back
+            percent = start + int((end - start) * min(float(match.group(1)), 100.0) / 100)
+            if percent > last_percent:
+                last_percent = percent
+                report_progress(percent)
+    except BaseException:
+        # Don't leave yt-dlp running if we are interrupted or fail mid-stream
+        process.kill()
+        process.wait()
+        raise
+    
+    returncode = process.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args)
+
+def _info_cache_path(url: str) -> Path:
+    """Cache file for a URL's yt-dlp info"""
+    return INFO_CACHE_DIR / f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.json"
+
+def _cached_info(url: str, ttl: int) -> Optional[str]:
+    """Return the cached info.json for a URL if it is younger than ttl seconds
+    
+    Entries of other URLs older than the default TTL (or ttl, if longer) are deleted on
+    the way, so the cache stays bounded without a short --cache-ttl wiping it.
+    """
+    cache_path = str(_info_cache_path(url))
+    prune_age = max(ttl, DEFAULT_CACHE_TTL)
+    now = time.time()
+    fresh_path = None
+    try:
+        entries = list(os.scandir(INFO_CACHE_DIR))
+    except OSError:
+        return None
+    for entry in entries:
+        try:
+            age = now - entry.stat().st_mtime
+            if entry.path == cache_path:
+                if age < ttl:
+                    fresh_path = entry.path
+            elif age >= prune_age:
+                os.unlink(entry.path)
+        except OSError:
+            pass
+    return fresh_path
+
+def _store_cached_info(url: str, info_json_path: str) -> None:
+    """Save a freshly fetched info.json in the URL cache"""
+    cache_path = _info_cache_path(url)
+    try:
+        os.makedirs(INFO_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.tmp"
+        shutil.copyfile(info_json_path, tmp_path)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Could not cache video info: {e}", file=sys.stderr)
+
 def get_video_format_for_quality(quality: str) -> str:
     """Get the yt-dlp format string for the specified quality"""
-    if quality == QUALITY_BEST:
-        return "bestvideo+bestaudio/best"
-    elif quality == QUALITY_1080P:
-        return "bestvideo[height<=1080]+bestaudio/best[height<=1080]"
-    elif quality == QUALITY_720P:
-        return "bestvideo[height<=720]+bestaudio/best[height<=720]"
-    elif quality == QUALITY_360P:
-        return "bestvideo[height<=360]+bestaudio/best[height<=360]"
-    else:
-        return "best"  # Default to best quality
-
-def get_video_dimensions(info_json_path: str) -> Dict[str, int]:
-    """Extract video dimensions from info.json"""
-    try:
-        with open(info_json_path, 'r', encoding='utf-8') as f:
-            info = json.load(f)
-            return {
-                "width": info.get("width", 0),
-                "height": info.get("height", 0)
-            }
-    except Exception as e:
-        print(f"Error getting video dimensions: {e}", file=sys.stderr)
-        return {"width": 0, "height": 0}
+    return QUALITY_FORMATS.get(quality, "best")  # Default to best quality
+
+def get_video_dimensions(info: Dict[str, Any]) -> Dict[str, int]:
+    """Extract video dimensions from the parsed info.json"""
+    return {
+        "width": info.get("width") or 0,
+        "height": info.get("height") or 0
+    }
 
-def get_file_size(file_path: str) -> int:
-    """Get file size in bytes"""
+def get_file_size(file: Union[str, os.DirEntry]) -> int:
+    """Get file size in bytes from a path, or from a scandir entry's cached stat"""
     try:
-        return os.path.getsize(file_path)
+        if isinstance(file, os.DirEntry):
+            return file.stat().st_size
+        return os.path.getsize(file)
     except Exception:
         return 0
 
-def get_video_duration(info_json_path: str) -> float:
-    """Extract video duration from info.json in seconds"""
-    try:
-        with open(info_json_path, 'r', encoding='utf-8') as f:
-            info = json.load(f)
-            return info.get("duration", 0)
-    except Exception as e:
-        print(f"Error getting video duration: {e}", file=sys.stderr)
-        return 0
+def get_video_duration(info: Dict[str, Any]) -> float:
+    """Extract video duration in seconds from the parsed info.json"""
+    return info.get("duration") or 0
 
-def is_iframe_only_video(info_json_path: str) -> bool:
-    """Determine if video is iframe-only or can be downloaded"""
-    try:
-        with open(info_json_path, 'r', encoding='utf-8') as f:
-            info = json.load(f)
-            # If no direct formats available or only iframe embedding is available
-            return len(info.get("formats", [])) == 0 or info.get("is_live", False)
-    except Exception as e:
-        print(f"Error determining video type: {e}", file=sys.stderr)
-        return False
+def is_iframe_only_video(info: Dict[str, Any]) -> bool:
+    """Determine from the parsed info.json if video is iframe-only or can be downloaded"""
+    # If no direct formats available or only iframe embedding is available
+    return not info.get("formats") or bool(info.get("is_live", False))
+
+def _download_file(url: str, dest_path: str) -> None:
+    """Stream a URL to a local file, raising on HTTP errors"""
+    # Written chunk by chunk, so large files are never held in memory as a whole
+    with _SESSION.get(url, stream=True, timeout=HTTP_TIMEOUT) as response:
+        response.raise_for_status()
+        with open(dest_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                f.write(chunk)
+
+def _find_vtt(info: Dict[str, Any], langs: Tuple[str, ...]) -> Optional[Tuple[str, str, str]]:
+    """Return (url, lang, source) of the best vtt track for a language group, or None"""
+    # Manual subtitles first, then automatic captions; within each, langs in priority order
+    for source in SUBTITLE_SOURCES:
+        table = info.get(source) or {}
+        for lang in langs:
+            formats = table.get(lang)
+            if not formats:
+                continue
+            # The first vtt track wins, in yt-dlp's order; no need to look at the rest
+            for format_info in formats:
+                if format_info.get('ext') == 'vtt':
+                    if format_info.get('url'):
+                        return format_info['url'], lang, source
+                    break
+    return None
 
 def extract_and_save_subtitles(info: Dict, content_dir: str) -> Dict[str, str]:
     """Extract subtitle URLs from info.json and download them"""
-    # Create logger
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger("subtitle_extractor")
-    
     transcript_paths = {}
     
     # Create transcripts directory if it doesn't exist
     transcripts_dir = os.path.join(content_dir, "transcripts")
     os.makedirs(transcripts_dir, exist_ok=True)
     
-    video_id = info.get('id', 'unknown')
-    subtitles = info.get('subtitles', {})
-    automatic_captions = info.get('automatic_captions', {})
-    
-    # 遍历查找英文vtt字幕
-    en_url = None
-    en_lang_found = None  # 记录找到的实际语言代码
-    en_source = None  # 记录字幕来源(手动/自动)
-    
-    # 首先检查手动字幕
-    for lang in ['en', 'en-US', 'en-orig', 'en-GB']:
-        if lang in subtitles and not en_url:
-            formats = subtitles[lang]
-            logger.info(f"找到手动{lang}语言字幕，包含{len(formats)}个格式")
-            
-            for format_info in formats:
-                if format_info.get('ext') == 'vtt':
-                    en_url = format_info.get('url')
-                    en_lang_found = lang
-                    en_source = 'subtitles'
-                    logger.info(f"找到英文vtt手动字幕 (语言代码: {lang})")
-                    break
-    
-    # 如果手动字幕中没找到，再检查自动字幕
-    if not en_url:
-        for lang in ['en', 'en-US', 'en-orig', 'en-GB']:
-            if lang in automatic_captions and not en_url:
-                formats = automatic_captions[lang]
-                logger.info(f"找到自动{lang}语言字幕，包含{len(formats)}个格式")
-                
-                for format_info in formats:
-                    if format_info.get('ext') == 'vtt':
-                        en_url = format_info.get('url')
-                        en_lang_found = lang
-                        en_source = 'automatic_captions'
-                        logger.info(f"找到英文vtt自动字幕 (语言代码: {lang})")
-                        break
-    
-    # 遍历查找中文vtt字幕
-    zh_url = None
-    zh_lang_found = None  # 记录找到的实际语言代码
-    zh_source = None  # 记录字幕来源(手动/自动)
+    # 每种语言按优先级查找vtt字幕, 手动字幕优先于自动字幕
+    downloads = []  # (文件类型, 下载地址, 文件名, 语言名)
+    for group, file_type, label in (("en", FILE_TYPE_TRANSCRIPT_EN_VTT, "英文"),
+                                    ("zh", FILE_TYPE_TRANSCRIPT_ZH_VTT, "中文")):
+        found = _find_vtt(info, LANG_GROUPS[group])
+        if not found:
+            logger.warning(f"未找到{label}vtt字幕")
+            continue
+        url, lang, source = found
+        logger.info(f"找到{label}vtt{'手动' if source == 'subtitles' else '自动'}字幕 (语言代码: {lang})")
+        downloads.append((file_type, url, f"transcript_{group}.vtt", label))
     
-    # 首先检查手动字幕
-    for lang in ['zh', 'zh-Hans', 'zh-CN', 'zh-TW', 'zh-HK']:
-        if lang in subtitles and not zh_url:
-            formats = subtitles[lang]
-            logger.info(f"找到手动{lang}语言字幕，包含{len(formats)}个格式")
-            
-            for format_info in formats:
-                if format_info.get('ext') == 'vtt':
-                    zh_url = format_info.get('url')
-                    zh_lang_found = lang
-                    zh_source = 'subtitles'
-                    logger.info(f"找到中文vtt手动字幕 (语言代码: {lang})")
-                    break
-    
-    # 如果手动字幕中没找到，再检查自动字幕
-    if not zh_url:
-        for lang in ['zh', 'zh-Hans', 'zh-CN', 'zh-TW', 'zh-HK']:
-            if lang in automatic_captions and not zh_url:
-                formats = automatic_captions[lang]
-                logger.info(f"找到自动{lang}语言字幕，包含{len(formats)}个格式")
-                
-                for format_info in formats:
-                    if format_info.get('ext') == 'vtt':
-                        zh_url = format_info.get('url')
-                        zh_lang_found = lang
-                        zh_source = 'automatic_captions'
-                        logger.info(f"找到中文vtt自动字幕 (语言代码: {lang})")
-                        break
-    
-    if not en_url:
-        logger.warning("未找到英文vtt字幕")
-    else:
-        # 下载英文字幕
-        en_dest_path = os.path.join(transcripts_dir, "transcript_en.vtt")
-        try:
-            response = requests.get(en_url)
-            response.raise_for_status()
-            with open(en_dest_path, 'wb') as f:
-                f.write(response.content)
-            logger.info(f"成功下载英文字幕到 {en_dest_path}")
-            transcript_paths[FILE_TYPE_TRANSCRIPT_EN_VTT] = os.path.join("transcripts", "transcript_en.vtt")
-        except Exception as e:
-            logger.error(f"下载英文字幕失败: {e}")
-    
-    if not zh_url:
-        logger.warning("未找到中文vtt字幕")
-    else:
-        # 下载中文字幕
-        zh_dest_path = os.path.join(transcripts_dir, "transcript_zh.vtt")
-        try:
-            response = requests.get(zh_url)
-            response.raise_for_status()
-            with open(zh_dest_path, 'wb') as f:
-                f.write(response.content)
-            logger.info(f"成功下载中文字幕到 {zh_dest_path}")
-            transcript_paths[FILE_TYPE_TRANSCRIPT_ZH_VTT] = os.path.join("transcripts", "transcript_zh.vtt")
-        except Exception as e:
-            logger.error(f"下载中文字幕失败: {e}")
-    
-    # 输出找到的字幕信息摘要
-    if en_url:
-        logger.info(f"英文字幕源: {en_source} (语言代码: {en_lang_found})")
-    if zh_url:
-        logger.info(f"中文字幕源: {zh_source} (语言代码: {zh_lang_found})")
+    # 并发下载字幕, 总耗时约等于最慢的一个
+    if downloads:
+        with ThreadPoolExecutor(max_workers=len(downloads)) as executor:
+            futures = [
+                (executor.submit(_download_file, url, os.path.join(transcripts_dir, filename)), file_type, filename, label)
+                for file_type, url, filename, label in downloads
+            ]
+            for future, file_type, filename, label in futures:
+                try:
+                    future.result()
+                    logger.info(f"成功下载{label}字幕到 {os.path.join(transcripts_dir, filename)}")
+                    transcript_paths[file_type] = os.path.join("transcripts", filename)
+                except Exception as e:
+                    logger.error(f"下载{label}字幕失败: {e}")
     
     return transcript_paths
 
 def update_manifest(manifest_path: str, files_to_add: Dict[str, Dict[str, Any]], task_id: str) -> None:
     """Update the manifest.json with new file entries and update task state"""
     try:
+        # Get current timestamp in ISO format; every field stamped below shares it
+        current_time = _now_iso()
+        
+        manifest = _load_manifest(manifest_path)
         # If manifest doesn't exist, create a basic one
-        if not os.path.exists(manifest_path):
+        if manifest is None:
             manifest = {
                 "id": task_id,
-                "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
-                "updatedAt": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+                "createdAt": current_time,
+                "updatedAt": current_time,
                 "fileManifest": [],
                 "tasks": [
                     {
                         "id": task_id,
                         "state": TASK_RUNNING,
                         "percent": 0,
-                        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
-                        "updatedAt": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
+                        "createdAt": current_time,
+                        "updatedAt": current_time
                     }
                 ]
             }
-        else:
-            # Read existing manifest
-            with open(manifest_path, 'r', encoding='utf-8') as f:
-                manifest = json.load(f)
-        
-        # Get current timestamp in ISO format
-        current_time = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
         
         # Update manifest fields
         manifest["updatedAt"] = current_time
         
-        # Check if files already exist in manifest and update or add as needed
+        # Index existing entries by type so each file to add is a direct lookup
         file_manifest = manifest.get("fileManifest", [])
+        files_by_type = {}
         for file_item in file_manifest:
-            file_type = file_item.get("type")
-            if file_type in files_to_add:
-                # Update existing entry
-                old_state = file_item.get("state")
-                file_item.update(files_to_add[file_type])
-                # Keep metadata.previousQualities if updating original_media
-                if file_type == FILE_TYPE_ORIGINAL_MEDIA and "metadata" in file_item and "previousQualities" in file_item["metadata"]:
-                    if "quality" in file_item["metadata"]:
-                        # Add previous quality to history if quality changed
-                        old_quality = file_item["metadata"]["quality"]
-                        new_quality = files_to_add[file_type]["metadata"]["quality"]
-                        if old_quality != new_quality and old_state == STATE_READY:
-                            if "previousQualities" not in files_to_add[file_type]["metadata"]:
-                                files_to_add[file_type]["metadata"]["previousQualities"] = []
-                            if old_quality not in files_to_add[file_type]["metadata"]["previousQualities"]:
-                                files_to_add[file_type]["metadata"]["previousQualities"].append(old_quality)
-                
-                files_to_add.pop(file_type)
+            files_by_type.setdefault(file_item.get("type"), file_item)
         
-        # Add new files that didn't exist before
         for file_type, file_data in files_to_add.items():
-            file_manifest.append(file_data)
+            file_item = files_by_type.get(file_type)
+            if file_item is None:
+                # Add new files that didn't exist before
+                file_manifest.append(file_data)
+                continue
+            
+            # Keep metadata.previousQualities if updating original_media
+            if file_type == FILE_TYPE_ORIGINAL_MEDIA and file_data.get("metadata"):
+                old_metadata = file_item.get("metadata") or {}
+                old_quality = old_metadata.get("quality")
+                previous_qualities = list(old_metadata.get("previousQualities") or [])
+                # Add previous quality to history if quality changed
+                if (old_quality and old_quality != file_data["metadata"].get("quality")
+                        and file_item.get("state") == STATE_READY
+                        and old_quality not in previous_qualities):
+                    previous_qualities.append(old_quality)
+                file_data = {**file_data, "metadata": {**file_data["metadata"], "previousQualities": previous_qualities}}
+            
+            # Update existing entry
+            file_item.update(file_data)
         
         manifest["fileManifest"] = file_manifest
         
@@ -304,48 +384,135 @@ def update_manifest(manifest_path: str, files_to_add: Dict[str, Dict[str, Any]],
             })
         
         # Write updated manifest back to file
-        with open(manifest_path, 'w', encoding='utf-8') as f:
-            json.dump(manifest, f, indent=2)
+        _save_manifest(manifest, manifest_path)
             
     except Exception as e:
         print(f"Error updating manifest: {e}", file=sys.stderr)
         sys.exit(1)
 
-def fetch_video_info(url: str, quality: str, content_dir: str, hash_id: str, task_id: str) -> None:
+def fetch_video_info(url: str, quality: str, content_dir: str, hash_id: str, task_id: str,
+                     use_cache: bool = True, cache_ttl: int = DEFAULT_CACHE_TTL) -> None:
     """Main function to fetch video info, download media and update manifest"""
-    # Create directories if they don't exist
+    # Every path this run touches, derived once from content_dir
     original_dir = os.path.join(content_dir, "original")
-    os.makedirs(original_dir, exist_ok=True)
-    
     manifest_path = os.path.join(content_dir, "manifest.json")
+    info_json_path = os.path.join(content_dir, "info.json")
+    # yt-dlp appends .info.json to the info output template
+    info_output = os.path.join(content_dir, "info")
+    raw_info_json_path = f"{info_output}.info.json"
+    # Info dumped ahead of the live-stream filter, which skips writing info.info.json
+    prefilter_info_path = os.path.join(content_dir, "info.prefilter.json")
+    thumbnail_output = os.path.join(original_dir, "thumbnail")
+    media_output = os.path.join(original_dir, "media.%(ext)s")
+    
+    # Create directories if they don't exist
+    os.makedirs(original_dir, exist_ok=True)
     
     # Report starting progress
     report_progress(0)
     
     try:
-        # First, get info JSON to determine video type and availability
-        info_json_path = os.path.join(content_dir, "info.json")
-        subprocess.run([
-            "yt-dlp", 
-            "--write-info-json", 
-            "--skip-download", 
-            "-o", os.path.join(content_dir, "info"),
-            url
-        ], check=True)
+        if os.path.exists(raw_info_json_path):
+            os.remove(raw_info_json_path)
         
-        # Rename info.info.json to info.json if needed
-        if not os.path.exists(info_json_path) and os.path.exists(os.path.join(content_dir, "info.info.json")):
-            shutil.move(os.path.join(content_dir, "info.info.json"), info_json_path)
+        # A single yt-dlp run writes info.json, the thumbnail and the media, so the
+        # extractor only fetches and decodes the video page once
+        yt_dlp_args = [
+            "yt-dlp",
+            "--newline",
+            "--progress-template", f"download:{PROGRESS_PREFIX} %(progress._percent_str)s",
+            "--write-info-json",
+            "-o", f"infojson:{info_output}",
+            "--write-thumbnail",
+            "--convert-thumbnails", "jpg",
+            "-o", f"thumbnail:{thumbnail_output}",
+            "-f", get_video_format_for_quality(quality),
+            "-o", media_output,
+            # Iframe-only videos have no formats; still write their info.json, so the
+            # failed download below can be told apart from a failed extraction
+            "--ignore-no-formats-error",
+            # Never start recording a live stream
+            "--match-filter", "!is_live",
+            # The filter rejects live streams before info.json is written, so also dump the
+            # info from the pre-processing stage, which runs ahead of it
+            "--print-to-file", "pre_process:%()j", prefilter_info_path
+        ]
         
-        # Load info to get video ID and check if downloadable
-        with open(info_json_path, 'r', encoding='utf-8') as f:
-            info = json.load(f)
+        # A recent info.json for this URL (e.g. a re-download at another quality) lets
+        # yt-dlp skip the extractor; if its media URLs no longer work, retry from the URL
+        cached_info_path = _cached_info(url, cache_ttl) if use_cache else None
+        cached_info = None
+        if cached_info_path:
+            try:
+                with open(cached_info_path, 'rb') as f:
+                    cached_info = _loads(f.read())
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable cached video info: {e}", file=sys.stderr)
+        
+        attempts = [[url]]
+        info_from_cache = False
+        if cached_info is not None and is_iframe_only_video(cached_info):
+            # Nothing to download, so the cached info is all yt-dlp would produce
+            print(f"Using cached video info {cached_info_path} without running yt-dlp", file=sys.stderr)
+            shutil.copyfile(cached_info_path, raw_info_json_path)
+            attempts = []
+            info_from_cache = True
+        elif cached_info is not None:
+            print(f"Using cached video info {cached_info_path}", file=sys.stderr)
+            attempts.insert(0, ["--load-info-json", cached_info_path])
+        
+        download_error = None
+        for source_args in attempts:
+            # yt-dlp appends to --print-to-file targets, so start every attempt afresh
+            if os.path.exists(prefilter_info_path):
+                os.remove(prefilter_info_path)
+            try:
+                run_yt_dlp_with_progress(yt_dlp_args + source_args, 0, 55)
+            except subprocess.CalledProcessError as e:
+                download_error = e
+                continue
+            download_error = None
+            info_from_cache = source_args[0] == "--load-info-json"
+            break
+        
+        # A live stream was filtered out after its info was dumped; use that instead
+        if os.path.exists(prefilter_info_path):
+            if not os.path.exists(raw_info_json_path):
+                os.replace(prefilter_info_path, raw_info_json_path)
+            else:
+                os.remove(prefilter_info_path)
+        
+        # Only when the extractor itself failed is there no info at all; fetch it on its own
+        if not os.path.exists(raw_info_json_path):
+            subprocess.run([
+                "yt-dlp",
+                "--write-info-json",
+                "--skip-download",
+                "-o", info_output,
+                url
+            ], check=True)
+        
+        # Rename info.info.json to info.json
+        if os.path.exists(raw_info_json_path):
+            os.replace(raw_info_json_path, info_json_path)
+        
+        # Only cache info that came from the network, so entries still expire after cache_ttl
+        if use_cache and not info_from_cache:
+            _store_cached_info(url, info_json_path)
+        
+        # Load info once; every helper below reads from this dict
+        with open(info_json_path, 'rb') as f:
+            info = _loads(f.read())
         
         video_id = info.get("id", "unknown")
-        media_type = "iframe" if is_iframe_only_video(info_json_path) else "local"
+        media_type = "iframe" if is_iframe_only_video(info) else "local"
+        
+        if media_type == "local" and download_error is not None:
+            # The video has formats, so the combined download failed for another reason
+            raise download_error
         
-        # Report progress after fetching info
-        report_progress(20)
+        # Report progress after fetching info and media
+        report_progress(60)
         
         files_to_add = {
             FILE_TYPE_INFO_JSON: {
@@ -361,22 +528,15 @@ def fetch_video_info(url: str, quality: str, content_dir: str, hash_id: str, tas
         
         # If media is downloadable, proceed with download
         if media_type == "local":
-            # Download thumbnail
-            subprocess.run([
-                "yt-dlp",
-                "--write-thumbnail",
-                "--skip-download",
-                "--convert-thumbnails", "jpg",
-                "-o", os.path.join(original_dir, "thumbnail"),
-                url
-            ], check=True)
+            # List the download directory once; the thumbnail and media lookups share it.
+            # is_file() uses the type scandir already returned, so it costs no extra stat
+            with os.scandir(original_dir) as it:
+                entries = [entry for entry in it if entry.is_file()]
             
             # Find thumbnail file
-            thumbnail_path = None
-            for file in os.listdir(original_dir):
-                if file.startswith("thumbnail") and (file.endswith(".jpg") or file.endswith(".webp")):
-                    thumbnail_path = os.path.join("original", file)
-                    break
+            thumbnail_entry = next((entry for entry in entries
+                                    if entry.name.startswith("thumbnail") and entry.name.endswith((".jpg", ".webp"))), None)
+            thumbnail_path = f"original/{thumbnail_entry.name}" if thumbnail_entry else None
             
             if thumbnail_path:
                 files_to_add[FILE_TYPE_ORIGINAL_THUMBNAIL] = {
@@ -389,21 +549,6 @@ def fetch_video_info(url: str, quality: str, content_dir: str, hash_id: str, tas
                     "metadata": None
                 }
             
-            # Report progress after thumbnail download
-            report_progress(30)
-            
-            # Download media with selected quality
-            format_string = get_video_format_for_quality(quality)
-            subprocess.run([
-                "yt-dlp",
-                "-f", format_string,
-                "-o", os.path.join(original_dir, "media.%(ext)s"),
-                url
-            ], check=True)
-            
-            # Report progress after media download
-            report_progress(60)
-            
             # 从info.json提取并下载字幕
             transcript_paths = extract_and_save_subtitles(info, content_dir)
             
@@ -411,17 +556,14 @@ def fetch_video_info(url: str, quality: str, content_dir: str, hash_id: str, tas
             report_progress(80)
             
             # Find media file
-            media_path = None
-            for file in os.listdir(original_dir):
-                if file.startswith("media."):
-                    media_path = os.path.join("original", file)
-                    break
+            media_entry = next((entry for entry in entries if entry.name.startswith("media.")), None)
+            media_path = f"original/{media_entry.name}" if media_entry else None
             
             if media_path:
                 # Get video metadata
-                dimensions = get_video_dimensions(info_json_path)
-                duration = get_video_duration(info_json_path)
-                disk_size = get_file_size(os.path.join(content_dir, media_path))
+                dimensions = get_video_dimensions(info)
+                duration = get_video_duration(info)
+                disk_size = get_file_size(media_entry)
                 
                 files_to_add[FILE_TYPE_ORIGINAL_MEDIA] = {
                     "type": FILE_TYPE_ORIGINAL_MEDIA,
@@ -459,12 +601,12 @@ def fetch_video_info(url: str, quality: str, content_dir: str, hash_id: str, tas
                 # Try to download the thumbnail separately
                 try:
                     thumbnail_url = info.get("thumbnail")
-                    thumbnail_path = os.path.join(original_dir, "thumbnail.jpg")
+                    thumbnail_path = f"{thumbnail_output}.jpg"
                     
-                    # Use subprocess to download thumbnail
-                    subprocess.run([
-                        "curl", "-L", thumbnail_url, "-o", thumbnail_path
-                    ], check=True)
+                    # The combined run already wrote it unless the video was live
+                    if not os.path.exists(thumbnail_path):
+                        # Download in-process instead of spawning curl
+                        _download_file(thumbnail_url, thumbnail_path)
                     
                     if os.path.exists(thumbnail_path):
                         files_to_add[FILE_TYPE_ORIGINAL_THUMBNAIL] = {
@@ -489,20 +631,18 @@ def fetch_video_info(url: str, quality: str, content_dir: str, hash_id: str, tas
         print(f"Error processing video: {e}", file=sys.stderr)
         # Update task state to error in manifest
         try:
+            current_time = _now_iso()
+            
+            manifest = _load_manifest(manifest_path)
             # Create manifest if it doesn't exist
-            if not os.path.exists(manifest_path):
+            if manifest is None:
                 manifest = {
                     "id": hash_id,
-                    "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
-                    "updatedAt": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+                    "createdAt": current_time,
+                    "updatedAt": current_time,
                     "fileManifest": [],
                     "tasks": []
                 }
-            else:
-                with open(manifest_path, 'r', encoding='utf-8') as f:
-                    manifest = json.load(f)
-            
-            current_time = time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())
             
             # Find task or create it
             task_found = False
@@ -525,21 +665,26 @@ def fetch_video_info(url: str, quality: str, content_dir: str, hash_id: str, tas
                     "updatedAt": current_time
                 })
             
-            with open(manifest_path, 'w', encoding='utf-8') as f:
-                json.dump(manifest, f, indent=2)
+            _save_manifest(manifest, manifest_path)
         except Exception as inner_e:
             print(f"Error updating manifest with error state: {inner_e}", file=sys.stderr)
         
         sys.exit(1)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    
     parser = argparse.ArgumentParser(description="Fetch video info and download media using yt-dlp")
     parser.add_argument("--url", required=True, help="URL of the video to download")
-    parser.add_argument("--quality", default=QUALITY_BEST, choices=[QUALITY_BEST, QUALITY_1080P, QUALITY_720P, QUALITY_360P], help="Video quality to download")
+    parser.add_argument("--quality", default=QUALITY_BEST, choices=list(QUALITY_FORMATS), help="Video quality to download")
     parser.add_argument("--content-dir", required=True, help="Content directory path")
     parser.add_argument("--hash-id", required=True, help="Hash ID for the content bucket")
     parser.add_argument("--task-id", required=True, help="Task ID to update in manifest")
     
+    parser.add_argument("--no-cache", action="store_true", help="Always fetch video info from the site instead of the local info cache")
+    parser.add_argument("--cache-ttl", type=int, default=DEFAULT_CACHE_TTL, help=f"Seconds a cached info.json stays fresh (default: {DEFAULT_CACHE_TTL})")
+    
     args = parser.parse_args()
     
-    fetch_video_info(args.url, args.quality, args.content_dir, args.hash_id, args.task_id) 
\ No newline at end of file
+    fetch_video_info(args.url, args.quality, args.content_dir, args.hash_id, args.task_id,
+                     use_cache=not args.no_cache, cache_ttl=args.cache_ttl) 
\ No newline at end of file
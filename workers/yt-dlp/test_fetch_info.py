@@ -4,7 +4,10 @@ Test script for fetch_info.py worker
 """
 
 import os
+import sys
 import json
+import shlex
+import subprocess
 import argparse
 import tempfile
 import shutil
@@ -48,18 +51,18 @@ def run_test(url, quality="best"):
         with open(manifest_path, 'w') as f:
             json.dump(SAMPLE_MANIFEST, f, indent=2)
         
-        # Run the fetch_info.py script
-        cmd = (
-            f'python3 fetch_info.py '
-            f'--url "{url}" '
-            f'--quality "{quality}" '
-            f'--content-dir "{temp_dir}" '
-            f'--hash-id "{hash_id}" '
-            f'--task-id "download_media"'
-        )
-        
-        print(f"Running command: {cmd}")
-        exit_code = os.system(cmd)
+        # Run the fetch_info.py script; an argv list needs no shell and no quoting of the URL
+        cmd = [
+            sys.executable, "fetch_info.py",
+            "--url", url,
+            "--quality", quality,
+            "--content-dir", temp_dir,
+            "--hash-id", hash_id,
+            "--task-id", "download_media"
+        ]
+        
+        print(f"Running command: {shlex.join(cmd)}")
+        exit_code = subprocess.run(cmd).returncode
         
         if exit_code != 0:
             print(f"Error: Command failed with exit code {exit_code}")